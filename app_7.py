@@ -1,61 +1,181 @@
 # Imports
+import hashlib
+import numpy as np
 import pandas as pd
 import streamlit as st
-import seaborn as sns
-import matplotlib.pyplot as plt
+import altair as alt
+from numba import njit
 from PIL import Image
 from io import BytesIO
 
-# Set seaborn theme for better plot visuals
-custom_params = {"axes.spines.right": False, "axes.spines.top": False}
-sns.set_theme(style="ticks", rc=custom_params)
+# Initial page configuration
+PAGE_CONFIG = dict(page_title='Telemarketing Analysis',
+                   page_icon='telmarketing_icon.png',
+                   layout="wide",
+                   initial_sidebar_state='expanded')
+
+# Categorical columns that can be filtered in the sidebar
+FILTER_COLUMNS = ['job', 'marital', 'default', 'housing', 'loan', 'contact', 'month', 'day_of_week']
+
+# Uploads from this size on are filtered by the compiled kernel
+NUMBA_MIN_ROWS = 100_000
 
 # Function to read data
-@st.cache(show_spinner=True)
-def load_data(file_data):
+# (cached on the hash of the upload; the underscore keeps the file out of the cache key,
+# so its bytes are only read on a miss. Held as a shared read-only resource so reruns
+# don't unpickle a fresh copy of the frame)
+@st.cache_resource(ttl="1h", max_entries=4, show_spinner=True)
+def load_data(file_key, _file):
+    file_data = BytesIO(_file.getvalue())
     try:
-        return pd.read_csv(file_data, sep=';')
-    except:
-        return pd.read_excel(file_data)
-
-# Function to filter based on multi-selection of categories
-@st.cache
-def multiselect_filter(relatorio, col, selecionados):
-    if 'all' in selecionados:
-        return relatorio
-    else:
-        return relatorio[relatorio[col].isin(selecionados)].reset_index(drop=True)
+        df = pd.read_csv(file_data, sep=';', engine='pyarrow')
+    except ValueError:
+        # Parse errors only: UnicodeDecodeError, ParserError and pyarrow's ArrowInvalid are all ValueError
+        file_data.seek(0)
+        df = pd.read_excel(file_data)
+
+    # Low-cardinality text columns as category
+    for c in ['job', 'marital', 'default', 'housing', 'loan', 'contact',
+              'month', 'day_of_week', 'education', 'poutcome']:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    # Ordered target so value counts come out already sorted, keeping
+    # the usual no/yes order and any other labels found in the file
+    if 'y' in df.columns:
+        labels = df['y'].dropna().unique().tolist()
+        if not set(labels) <= {'no', 'yes'}:
+            categories = sorted(labels, key=str)
+        else:
+            categories = ['no', 'yes']
+        df['y'] = pd.Categorical(df['y'], categories=categories, ordered=True)
+
+    # Sidebar metadata, computed once per upload
+    meta = {'age_min': int(df.age.min()),
+            'age_max': int(df.age.max()),
+            'options': {c: df[c].unique().tolist() + ['all'] for c in FILTER_COLUMNS}}
+    return df, meta
+
+# Function to stack the category codes of the filter columns (read-only)
+@st.cache_resource(max_entries=4, show_spinner=False)
+def filter_codes(file_key, _df):
+    # np.stack upcasts to the widest native codes dtype, so no column wraps around
+    return np.stack([_df[c].cat.codes.to_numpy() for c in FILTER_COLUMNS])
+
+# Function to test every row against all the filters in a single pass
+@njit(cache=True)
+def combined_mask(age, lo, hi, codes, rows, allowed):
+    out = np.empty(age.shape[0], np.bool_)
+    for i in range(age.shape[0]):
+        ok = lo <= age[i] <= hi
+        for j in range(rows.shape[0]):
+            if not ok:
+                break
+            c = codes[rows[j], i]
+            ok = c >= 0 and allowed[j, c]
+        out[i] = ok
+    return out
+
+# Function to build the boolean mask of the selected filters
+def filter_mask(df, file_key, idades, active):
+    if len(df) >= NUMBA_MIN_ROWS:
+        rows = np.array([FILTER_COLUMNS.index(col) for col, _ in active], dtype=np.int64)
+        n_categories = max((len(df[col].cat.categories) for col, _ in active), default=1)
+        allowed = np.zeros((len(active), n_categories), dtype=np.bool_)
+        for j, (col, selecionados) in enumerate(active):
+            sel_codes = df[col].cat.categories.get_indexer(selecionados)
+            allowed[j, sel_codes[sel_codes >= 0]] = True
+        return combined_mask(df.age.to_numpy(), idades[0], idades[1],
+                             filter_codes(file_key, df), rows, allowed)
+
+    mask = df.age.between(idades[0], idades[1]).to_numpy()
+    for col, selecionados in active:
+        # Compare the integer category codes instead of the labels
+        cat = df[col].cat
+        sel_codes = cat.categories.get_indexer(selecionados)
+        mask &= np.isin(cat.codes.to_numpy(), sel_codes[sel_codes >= 0])
+    return mask
+
+# Function to compute the percentage of each target class
+@st.cache_data(max_entries=16, show_spinner=False)
+def target_percentage(key, _df):
+    vc = _df['y'].value_counts(normalize=True, sort=False, dropna=False)
+    return (vc * 100).rename('percentage').to_frame()
 
 # Function to convert df to csv
-@st.cache
+@st.cache_data(ttl="1h", max_entries=8, show_spinner=False)
 def convert_df(df):
     return df.to_csv(index=False).encode('utf-8')
 
+# Function to hash a df with pandas' vectorized row hashing
+def frame_key(df):
+    return (tuple(df.columns), df.shape, int(pd.util.hash_pandas_object(df).sum()))
+
 # Function to convert df to excel
-@st.cache
+@st.cache_data(ttl="1h", max_entries=8, show_spinner=False,
+               hash_funcs={pd.DataFrame: frame_key})
 def to_excel(df):
     output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='Sheet1')
-    writer.save()
-    processed_data = output.getvalue()
-    return processed_data
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Sheet1')
+    return output.getvalue()
+
+# Function to draw the acceptance proportion chart of one table
+def acceptance_chart(target_perc, graph_type, title):
+    source = pd.DataFrame({'y': target_perc.index.astype(str),
+                           'percentage': target_perc['percentage'].to_numpy()})
+    if graph_type == 'Bar':
+        base = alt.Chart(source).encode(x=alt.X('y:N', title=None),
+                                        y=alt.Y('percentage:Q'))
+        labels = base.mark_text(dy=-6).encode(text=alt.Text('percentage:Q', format='.1f'))
+        chart = base.mark_bar() + labels
+    else:
+        base = alt.Chart(source).encode(theta=alt.Theta('percentage:Q', stack=True),
+                                        color=alt.Color('y:N'))
+        labels = base.mark_text(radius=140).encode(text=alt.Text('percentage:Q', format='.2f'))
+        chart = base.mark_arc(outerRadius=120) + labels
+    return chart.properties(title=title)
+
+# Function to render the acceptance proportion section
+# (a fragment, so switching the graph type only reruns the charts)
+@st.fragment
+def render_plots(bank_raw_target_perc, bank_target_perc):
+    st.write('## Acceptance proportion')
+    # Select graph type
+    graph_type = st.radio('Graph type:', ('Bar', 'Pie'), horizontal=True)
+    col1, col2 = st.columns(2)
+    col1.altair_chart(acceptance_chart(bank_raw_target_perc, graph_type, 'Raw data'),
+                      use_container_width=True)
+    col2.altair_chart(acceptance_chart(bank_target_perc, graph_type, 'Filtered data'),
+                      use_container_width=True)
+
+# Function to render the filtered table download
+@st.fragment
+def excel_download(bank, filter_key):
+    if st.button('Prepare filtered table in EXCEL'):
+        st.session_state['xlsx'] = to_excel(bank)
+        st.session_state['xlsx_key'] = filter_key
+    # Only offer the file built for the filters currently applied
+    if st.session_state.get('xlsx_key') == filter_key:
+        st.download_button(label='📥 Download filtered table in EXCEL',
+                           data=st.session_state['xlsx'],
+                           file_name='bank_filtered.xlsx')
+
+# Function to load the sidebar image
+@st.cache_resource
+def sidebar_image():
+    return Image.open("Bank-Branding.jpg")
 
 # Main function of the application
 def main():
     # Initial page configuration
-    st.set_page_config(page_title='Telemarketing Analysis',
-                       page_icon='telmarketing_icon.png',
-                       layout="wide",
-                       initial_sidebar_state='expanded')
+    st.set_page_config(**PAGE_CONFIG)
 
     # Main title of the application
     st.write('# Telemarketing Analysis')
     st.markdown("---")
     
     # Display image in the sidebar
-    image = Image.open("Bank-Branding.jpg")
-    st.sidebar.image(image)
+    st.sidebar.image(sidebar_image())
 
     # Button to upload file in the application
     st.sidebar.write("## Upload the file")
@@ -63,104 +183,93 @@ def main():
 
     # Check if there is any uploaded content
     if data_file_1 is not None:
-        bank_raw = load_data(data_file_1)
-        bank = bank_raw.copy()
+        # Hash the upload once and key every derived cache on it
+        if st.session_state.get('upload_file_id') != data_file_1.file_id:
+            st.session_state['upload_file_id'] = data_file_1.file_id
+            st.session_state['file_key'] = hashlib.blake2b(data_file_1.getvalue(),
+                                                           digest_size=16).hexdigest()
+        file_key = st.session_state['file_key']
+        bank_raw, meta = load_data(file_key, data_file_1)
 
+        # Previews are only serialized when switched on (a collapsed
+        # st.expander would still send its contents on every rerun)
         st.write('## Before filtering')
-        st.write(bank_raw.head())
-
-        # Check if 'y' column exists and print columns
-        st.write('### Columns in the dataset:')
-        st.write(bank.columns.tolist())
+        if st.toggle('Show preview', key='preview_raw'):
+            st.write(bank_raw.head())
+            st.write('### Columns in the dataset:')
+            st.write(bank_raw.columns.tolist())
 
         with st.sidebar.form(key='my_form'):
-            # Select graph type
-            graph_type = st.radio('Graph type:', ('Bar', 'Pie'))
-        
             # Age filter
-            max_age = int(bank.age.max())
-            min_age = int(bank.age.min())
+            max_age = meta['age_max']
+            min_age = meta['age_min']
             idades = st.slider(label='Age', 
                                min_value=min_age,
                                max_value=max_age, 
                                value=(min_age, max_age),
                                step=1)
 
+            # Categorical filters
+            options = meta['options']
+
             # Profession filter
-            jobs_list = bank.job.unique().tolist()
-            jobs_list.append('all')
-            jobs_selected = st.multiselect("Profession", jobs_list, ['all'])
+            jobs_selected = st.multiselect("Profession", options['job'], ['all'])
 
             # Marital status filter
-            marital_list = bank.marital.unique().tolist()
-            marital_list.append('all')
-            marital_selected = st.multiselect("Marital status", marital_list, ['all'])
+            marital_selected = st.multiselect("Marital status", options['marital'], ['all'])
 
             # Default filter
-            default_list = bank.default.unique().tolist()
-            default_list.append('all')
-            default_selected = st.multiselect("Default", default_list, ['all'])
+            default_selected = st.multiselect("Default", options['default'], ['all'])
 
             # Housing loan filter
-            housing_list = bank.housing.unique().tolist()
-            housing_list.append('all')
-            housing_selected = st.multiselect("Has housing loan?", housing_list, ['all'])
+            housing_selected = st.multiselect("Has housing loan?", options['housing'], ['all'])
 
             # Personal loan filter
-            loan_list = bank.loan.unique().tolist()
-            loan_list.append('all')
-            loan_selected = st.multiselect("Has personal loan?", loan_list, ['all'])
+            loan_selected = st.multiselect("Has personal loan?", options['loan'], ['all'])
 
             # Contact filter
-            contact_list = bank.contact.unique().tolist()
-            contact_list.append('all')
-            contact_selected = st.multiselect("Contact", contact_list, ['all'])
+            contact_selected = st.multiselect("Contact", options['contact'], ['all'])
 
             # Month filter
-            month_list = bank.month.unique().tolist()
-            month_list.append('all')
-            month_selected = st.multiselect("Contact month", month_list, ['all'])
+            month_selected = st.multiselect("Contact month", options['month'], ['all'])
 
             # Day of the week filter
-            day_of_week_list = bank.day_of_week.unique().tolist()
-            day_of_week_list.append('all')
-            day_of_week_selected = st.multiselect("Day of the week", day_of_week_list, ['all'])
-
-            # Method chaining to filter the selection
-            bank = (bank.query("age >= @idades[0] and age <= @idades[1]")
-                        .pipe(multiselect_filter, 'job', jobs_selected)
-                        .pipe(multiselect_filter, 'marital', marital_selected)
-                        .pipe(multiselect_filter, 'default', default_selected)
-                        .pipe(multiselect_filter, 'housing', housing_selected)
-                        .pipe(multiselect_filter, 'loan', loan_selected)
-                        .pipe(multiselect_filter, 'contact', contact_selected)
-                        .pipe(multiselect_filter, 'month', month_selected)
-                        .pipe(multiselect_filter, 'day_of_week', day_of_week_selected)
-                    )
+            day_of_week_selected = st.multiselect("Day of the week", options['day_of_week'], ['all'])
+
+            # Single boolean mask combining the filters that restrict something
+            active = [(col, selecionados)
+                      for col, selecionados in [('job', jobs_selected),
+                                                ('marital', marital_selected),
+                                                ('default', default_selected),
+                                                ('housing', housing_selected),
+                                                ('loan', loan_selected),
+                                                ('contact', contact_selected),
+                                                ('month', month_selected),
+                                                ('day_of_week', day_of_week_selected)]
+                      if 'all' not in selecionados]
+            mask = filter_mask(bank_raw, file_key, idades, active)
+            bank = bank_raw.loc[mask].reset_index(drop=True)
+            filter_key = (file_key, tuple(idades),
+                          tuple((col, tuple(selecionados)) for col, selecionados in active))
 
             submit_button = st.form_submit_button(label='Apply')
         
         # Download buttons for filtered data
         st.write('## After filtering')
-        st.write(bank.head())
+        show_filtered_preview = st.toggle('Show preview', key='preview_filtered')
+        if show_filtered_preview:
+            st.write(bank.head())
         
-        df_xlsx = to_excel(bank)
-        st.download_button(label='📥 Download filtered table in EXCEL',
-                           data=df_xlsx,
-                           file_name='bank_filtered.xlsx')
+        # Excel file is only built on request
+        excel_download(bank, filter_key)
         st.markdown("---")
 
-        # Check if 'y' column exists and print columns
-        st.write('### Columns after filtering:')
-        st.write(bank.columns.tolist())
-
-        # Plots    
-        fig, ax = plt.subplots(1, 2, figsize=(10, 5))
+        if show_filtered_preview:
+            st.write('### Columns after filtering:')
+            st.write(bank.columns.tolist())
 
         if 'y' in bank_raw.columns:
-            bank_raw_target_perc = bank_raw.y.value_counts(normalize=True).to_frame() * 100
-            bank_raw_target_perc.columns = ['percentage']
-            bank_raw_target_perc = bank_raw_target_perc.sort_index()
+            bank_raw_target_perc = target_percentage(file_key, bank_raw)
             st.write('### Bank Raw Target Perc:')
             st.write(bank_raw_target_perc)
         else:
@@ -168,9 +277,8 @@ def main():
 
         if 'y' in bank.columns:
             try:
-                bank_target_perc = bank.y.value_counts(normalize=True).to_frame() * 100
-                bank_target_perc.columns = ['percentage']
-                bank_target_perc = bank_target_perc.sort_index()
+                # Cached on the applied filters, so only recomputed when they change
+                bank_target_perc = target_percentage(filter_key, bank)
                 st.write('### Bank Target Perc:')
                 st.write(bank_target_perc)
             except KeyError as e:
@@ -199,33 +307,7 @@ def main():
         st.markdown("---")
     
         if 'y' in bank_raw.columns and 'y' in bank.columns:
-            st.write('## Acceptance proportion')
-            if graph_type == 'Bar':
-                sns.barplot(x=bank_raw_target_perc.index, 
-                            y=bank_raw_target_perc['percentage'],
-                            data=bank_raw_target_perc, 
-                            ax=ax[0])
-                ax[0].bar_label(ax[0].containers[0])
-                ax[0].set_title('Raw data',
-                                fontweight="bold")
-                
-                sns.barplot(x=bank_target_perc.index, 
-                            y=bank_target_perc['percentage'], 
-                            data=bank_target_perc, 
-                            ax=ax[1])
-                ax[1].bar_label(ax[1].containers[0])
-                ax[1].set_title('Filtered data',
-                                fontweight="bold")
-            else:
-                bank_raw_target_perc.plot(kind='pie', y='percentage', autopct='%.2f', ax=ax[0])
-                ax[0].set_title('Raw data',
-                                fontweight="bold")
-                
-                bank_target_perc.plot(kind='pie', y='percentage', autopct='%.2f', ax=ax[1])
-                ax[1].set_title('Filtered data',
-                                fontweight="bold")
-
-            st.pyplot(plt)
+            render_plots(bank_raw_target_perc, bank_target_perc)
 
 if __name__ == '__main__':
     main()